@@ -1,79 +1,208 @@
-import requests
+import httpx
+import ijson
+import orjson
+import asyncio
+import base64
+import re
 import json
-from typing import Dict, List, Any, Optional
+import xxhash
+from collections import ChainMap, OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
 import os
 
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled async client shared by every agent in the process"""
+    # http2 and limits are set on the transport: httpx ignores the client-level ones once a transport is given
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        retries=2  # connection failures only; 502/503/504 responses are not retried
+    )
+    # Follow redirects like requests did; httpx otherwise treats a 3xx as the final response
+    return httpx.AsyncClient(transport=transport, timeout=30.0, follow_redirects=True)
+
+# Message header shared by every FHIR -> HL7 conversion
+_MSH_SEGMENT = "MSH|^~\\&|SENDING_APP|SENDING_FACILITY|RECEIVING_APP|RECEIVING_FACILITY|20230615120000||ADT^A01|MSG00001|P|2.5"
+
+# Header plus PID segment, filled from the FHIR resource with the name fields overlaid
+_PID_MESSAGE_TEMPLATE = _MSH_SEGMENT + "\rPID|||{id}||{family}^{given}||{birthDate}|{gender}"
+_PID_DEFAULTS = {"id": "", "gender": "", "birthDate": ""}
+
+class _AsyncStreamReader:
+    """Adapts a streaming httpx response to the async file-like object ijson reads from"""
+    
+    def __init__(self, response: httpx.Response):
+        self._chunks = response.aiter_bytes()
+        self._buffer = b""
+    
+    async def read(self, size: int = -1) -> bytes:
+        # ijson probes with read(0) to tell bytes from str, so that call must not consume a chunk
+        while not self._buffer and size != 0:
+            try:
+                self._buffer = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                break
+        
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+# Segment types the parser extracts data from
+_PID = "PID"
+_OBX = "OBX"
+
+# Matches a PID or OBX segment with at least five fields and captures only the fields the
+# parser uses, stopping after field 6 so long trailing fields are never sliced
+_SEGMENT_RE = re.compile(
+    r"(?:\A|(?<=\r))(" + _PID + "|" + _OBX + r")"
+    r"\|[^|\r]*\|[^|\r]*\|([^|\r]*)"
+    r"\|[^|\r]*\|([^|\r]*)"
+    r"(?:\|([^|\r]*))?"
+)
+
+# LRU of parsed HL7 messages keyed by their xxh3 digest; retries of the same message skip parsing.
+# Entries are (message length, result). The cache is bounded by the total length of the cached
+# messages, and large messages (e.g. OBX segments carrying base64 documents) are never cached.
+_PARSE_CACHE: "OrderedDict[int, Tuple[int, Dict]]" = OrderedDict()
+_PARSE_CACHE_MAX_MESSAGE = 64 * 1024
+_PARSE_CACHE_MAX_TOTAL = 8 * 1024 * 1024
+_parse_cache_total = 0
+
+def _copy_parsed(result: Dict) -> Dict:
+    """Copy a parsed message so callers can't mutate what the cache holds"""
+    copy = dict(result)
+    if "observations" in copy:
+        copy["observations"] = [dict(observation) for observation in copy["observations"]]
+    return copy
+
+def _is_text_content(content_type: str) -> bool:
+    """Whether a Content-Type is textual, so its body can be returned as a decoded string"""
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return (
+        media_type.startswith("text/")
+        or media_type.endswith(("/json", "+json", "/xml", "+xml"))
+        or media_type in ("application/javascript", "application/x-www-form-urlencoded")
+    )
+
 class HealthcareAgent:
     """
     An AI agent for healthcare data retrieval and processing.
     Supports FHIR and HL7 standards and can call multiple APIs.
     """
     
-    def __init__(self, base_fhir_url: str = None, api_key: str = None):
+    def __init__(self, base_fhir_url: str = None, api_key: str = None,
+                 client: Optional[httpx.AsyncClient] = None):
         self.base_fhir_url = base_fhir_url or "https://hapi.fhir.org/baseR4"  # Default to public FHIR server
         self.api_key = api_key
-        self.headers = {
+        headers = {
             "Content-Type": "application/fhir+json",
             "Accept": "application/fhir+json"
         }
         if api_key:
-            self.headers["Authorization"] = f"Bearer {api_key}"
+            headers["Authorization"] = f"Bearer {api_key}"
+        # Normalized once here; httpx copies a Headers instance per request without re-encoding it.
+        # Kept off the client itself so the bearer token is never sent by call_external_api.
+        self.headers = httpx.Headers(headers)
+        
+        # Only close the client on aclose() if the agent created it itself
+        self._owns_client = client is None
+        self.client = client or create_http_client()
+        self._dispatch = {
+            "GET": self.client.get,
+            "POST": self.client.post,
+            "PUT": self.client.put,
+            "DELETE": self.client.delete
+        }
+    
+    async def aclose(self):
+        """Release pooled connections held by the agent's client"""
+        if self._owns_client:
+            await self.client.aclose()
     
-    def get_patient(self, patient_id: str) -> Dict:
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+    
+    async def get_patient(self, patient_id: str) -> Dict:
         """Retrieve patient information using FHIR API"""
         endpoint = f"{self.base_fhir_url}/Patient/{patient_id}"
-        response = requests.get(endpoint, headers=self.headers)
+        response = await self.client.get(endpoint, headers=self.headers)
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
     
-    def search_patients(self, params: Dict) -> List[Dict]:
+    async def search_patients(self, params: Dict) -> List[Dict]:
         """Search for patients matching criteria"""
         endpoint = f"{self.base_fhir_url}/Patient"
-        response = requests.get(endpoint, headers=self.headers, params=params)
-        response.raise_for_status()
-        return response.json().get("entry", [])
+        return await self._stream_bundle_entries(endpoint, params)
     
-    def get_patient_observations(self, patient_id: str) -> List[Dict]:
+    async def get_patient_observations(self, patient_id: str) -> List[Dict]:
         """Get clinical observations for a patient"""
         endpoint = f"{self.base_fhir_url}/Observation"
         params = {"patient": patient_id}
-        response = requests.get(endpoint, headers=self.headers, params=params)
-        response.raise_for_status()
-        return response.json().get("entry", [])
+        return await self._stream_bundle_entries(endpoint, params)
+    
+    async def _stream_bundle_entries(self, endpoint: str, params: Dict) -> List[Dict]:
+        """Fetch a FHIR Bundle and decode only its entries, streaming them out of the response"""
+        async with self.client.stream("GET", endpoint, headers=self.headers, params=params) as response:
+            response.raise_for_status()
+            items = ijson.items_async(_AsyncStreamReader(response), "entry.item", use_float=True)
+            return [entry async for entry in items]
     
     def parse_hl7_message(self, hl7_message: str) -> Dict:
         """
         Parse an HL7 message and convert to structured data
+        Results for small messages are cached by message hash
+        """
+        global _parse_cache_total
+        size = len(hl7_message)
+        if size > _PARSE_CACHE_MAX_MESSAGE:
+            return self._parse_hl7_message(hl7_message)
+        
+        key = xxhash.xxh3_128_intdigest(hl7_message)
+        cache = _PARSE_CACHE
+        entry = cache.get(key)
+        if entry is not None:
+            cache.move_to_end(key)
+            return _copy_parsed(entry[1])
+        
+        result = self._parse_hl7_message(hl7_message)
+        cache[key] = (size, result)
+        _parse_cache_total += size
+        while _parse_cache_total > _PARSE_CACHE_MAX_TOTAL:
+            _parse_cache_total -= cache.popitem(last=False)[1][0]
+        return _copy_parsed(result)
+    
+    def _parse_hl7_message(self, hl7_message: str) -> Dict:
+        """
         This is a simplified implementation - production code would use a proper HL7 parser
         """
-        # Simple parsing logic for demonstration
-        segments = hl7_message.split("\r")
+        # The compiled pattern finds handled segments and captures their fields in C
         result = {}
+        obs_append = None
         
-        for segment in segments:
-            if not segment:
-                continue
-                
-            fields = segment.split("|")
-            segment_type = fields[0]
+        for match in _SEGMENT_RE.finditer(hl7_message):
+            segment_type, field3, field5, field6 = match.groups()
             
-            if segment_type == "PID":  # Patient identification
-                if len(fields) > 5:
-                    result["patient_id"] = fields[3]
-                    name_parts = fields[5].split("^") if len(fields) > 5 else []
-                    if len(name_parts) >= 2:
-                        result["last_name"] = name_parts[0]
-                        result["first_name"] = name_parts[1]
+            if segment_type == _OBX:  # Observation: id, value and units in fields 3, 5 and 6
+                if obs_append is None:
+                    observations = []
+                    result["observations"] = observations
+                    obs_append = observations.append
+                obs_append({
+                    "id": field3,
+                    "value": field5,
+                    "units": field6
+                })
             
-            elif segment_type == "OBX":  # Observation
-                if len(fields) > 5:
-                    if "observations" not in result:
-                        result["observations"] = []
-                    result["observations"].append({
-                        "id": fields[3],
-                        "value": fields[5],
-                        "units": fields[6] if len(fields) > 6 else None
-                    })
+            else:  # Patient identification: id in field 3, family^given name in field 5
+                result["patient_id"] = field3
+                family, sep, rest = field5.partition("^")
+                if sep:
+                    result["last_name"] = family
+                    result["first_name"] = rest.partition("^")[0]
                     
         return result
     
@@ -82,66 +211,75 @@ class HealthcareAgent:
         Convert FHIR data to HL7 format (simplified)
         """
         # This is a very simplified conversion for demonstration
-        hl7_message = []
-        
-        # Message header
-        hl7_message.append("MSH|^~\\&|SENDING_APP|SENDING_FACILITY|RECEIVING_APP|RECEIVING_FACILITY|20230615120000||ADT^A01|MSG00001|P|2.5")
+        names = fhir_data.get("name")
+        if not names:
+            return _MSH_SEGMENT
         
         # Patient data
-        if "name" in fhir_data and fhir_data["name"]:
-            name = fhir_data["name"][0]
-            family = name.get("family", "")
-            given = name.get("given", [""])[0] if "given" in name and name["given"] else ""
-            
-            patient_id = fhir_data.get("id", "")
-            gender = fhir_data.get("gender", "")
-            birth_date = fhir_data.get("birthDate", "")
-            
-            hl7_message.append(f"PID|||{patient_id}||{family}^{given}||{birth_date}|{gender}")
-        
-        return "\r".join(hl7_message)
+        name = names[0]
+        given_names = name.get("given")
+        patient_name = {
+            "family": name.get("family", ""),
+            "given": given_names[0] if given_names else ""
+        }
+        return _PID_MESSAGE_TEMPLATE.format_map(ChainMap(patient_name, fhir_data, _PID_DEFAULTS))
     
-    def call_external_api(self, url: str, method: str = "GET", data: Optional[Dict] = None, 
-                         headers: Optional[Dict] = None) -> Dict:
-        """Generic method to call external APIs"""
-        request_headers = headers or {}
-        
-        if method.upper() == "GET":
-            response = requests.get(url, headers=request_headers)
-        elif method.upper() == "POST":
-            response = requests.post(url, json=data, headers=request_headers)
-        elif method.upper() == "PUT":
-            response = requests.put(url, json=data, headers=request_headers)
-        elif method.upper() == "DELETE":
-            response = requests.delete(url, headers=request_headers)
-        else:
+    async def call_external_api(self, url: str, method: str = "GET", data: Optional[Dict] = None, 
+                         headers: Optional[Dict] = None, parse: bool = True) -> Dict:
+        """
+        Generic method to call external APIs
+        With parse=False the response is passed through without raising on error statuses:
+        status, headers and body, with "encoding" telling whether "content" is text or base64
+        """
+        method = method.upper()
+        send = self._dispatch.get(method)
+        if send is None:
             raise ValueError(f"Unsupported HTTP method: {method}")
+        
+        kwargs = {"headers": headers or {}}
+        if method in ("POST", "PUT"):
+            kwargs["json"] = data
+        response = await send(url, **kwargs)
             
+        if not parse:
+            if _is_text_content(response.headers.get("content-type", "")):
+                content, encoding = response.text, "text"
+            else:
+                content, encoding = base64.b64encode(response.content).decode("ascii"), "base64"
+            return {
+                "status_code": response.status_code,
+                "content": content,
+                "encoding": encoding,
+                "headers": dict(response.headers)
+            }
+        
         response.raise_for_status()
-        return response.json() if response.content else {}
+        return orjson.loads(response.content) if response.content else {}
 
 # Example usage
-if __name__ == "__main__":
+async def main():
     # Initialize the agent
-    agent = HealthcareAgent()
-    
-    # Example: Get patient data
-    try:
-        # Using a sample patient ID from the public HAPI FHIR server
-        patient = agent.get_patient("example")
-        print("Patient data:")
-        print(json.dumps(patient, indent=2))
-        
-        # Example HL7 message parsing
-        hl7_message = """MSH|^~\\&|SENDING_APP|SENDING_FACILITY|RECEIVING_APP|RECEIVING_FACILITY|20230615120000||ADT^A01|MSG00001|P|2.5
+    async with HealthcareAgent() as agent:
+        # Example: Get patient data
+        try:
+            # Using a sample patient ID from the public HAPI FHIR server
+            patient = await agent.get_patient("example")
+            print("Patient data:")
+            print(json.dumps(patient, indent=2))
+            
+            # Example HL7 message parsing
+            hl7_message = """MSH|^~\\&|SENDING_APP|SENDING_FACILITY|RECEIVING_APP|RECEIVING_FACILITY|20230615120000||ADT^A01|MSG00001|P|2.5
 PID|||12345||Smith^John||19800101|M
 OBX||NM|8302-2^Height^LN||180|cm
 OBX||NM|8462-4^BP Diastolic^LN||80|mm[Hg]
 OBX||NM|8480-6^BP Systolic^LN||120|mm[Hg]"""
-        
-        parsed_hl7 = agent.parse_hl7_message(hl7_message)
-        print("\nParsed HL7 message:")
-        print(json.dumps(parsed_hl7, indent=2))
-        
-    except Exception as e:
-        print(f"Error: {e}")
\ No newline at end of file
+            
+            parsed_hl7 = agent.parse_hl7_message(hl7_message)
+            print("\nParsed HL7 message:")
+            print(json.dumps(parsed_hl7, indent=2))
+            
+        except Exception as e:
+            print(f"Error: {e}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,100 +1,186 @@
-from fastapi import FastAPI, HTTPException, Depends, Body
+from fastapi import FastAPI, HTTPException, Depends, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from typing import Dict, List, Optional, Any
-import uvicorn
+from contextlib import asynccontextmanager
 import json
+import asyncio
+import os
+import msgspec
+import httpx
 from agent import HealthcareAgent
+from cache import cached, create_redis_client
 
-app = FastAPI(title="Healthcare AI Agent API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One agent (and so one pooled client) for the whole process so outbound FHIR calls reuse connections
+    # In production, you might want to get these from environment variables
+    base_fhir_url = "https://hapi.fhir.org/baseR4"
+    api_key = None
+    app.state.agent = HealthcareAgent(base_fhir_url, api_key)
+    app.state.redis = create_redis_client()
+    yield
+    await app.state.agent.aclose()
+    await app.state.redis.aclose()
+
+app = FastAPI(title="Healthcare AI Agent API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # In production, replace with specific origins
+    # Explicit origins instead of "*", which browsers reject together with credentials;
+    # set CORS_ORIGIN_REGEX for deployed frontends, e.g. ^https://(app|staging)\.example\.com$
+    allow_origin_regex=os.getenv("CORS_ORIGIN_REGEX", r"^https?://(localhost|127\.0\.0\.1)(:\d+)?$"),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Compress larger responses such as FHIR Bundles; small payloads aren't worth the CPU
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Models
-class PatientSearch(BaseModel):
+class PatientSearch(msgspec.Struct):
     name: Optional[str] = None
     identifier: Optional[str] = None
     birthdate: Optional[str] = None
     gender: Optional[str] = None
 
-class ApiRequest(BaseModel):
+class ApiRequest(msgspec.Struct):
     url: str
     method: str = "GET"
     data: Optional[Dict] = None
     headers: Optional[Dict] = None
+    parse: bool = True
 
-class Hl7Message(BaseModel):
+class Hl7Message(msgspec.Struct):
     message: str
 
-class FhirData(BaseModel):
+class FhirData(msgspec.Struct):
     data: Dict[str, Any]
 
+def body_as(model: type):
+    """Dependency decoding and validating the JSON request body straight into a msgspec Struct"""
+    decoder = msgspec.json.Decoder(model)
+    
+    async def decode_body(request: Request):
+        try:
+            return decoder.decode(await request.body())
+        except msgspec.DecodeError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid request body: {str(e)}")
+    
+    return decode_body
+
+# Component schemas for msgspec request bodies, merged into the generated OpenAPI document
+_BODY_SCHEMAS: Dict[str, Any] = {}
+
+def body_schema(model: type) -> Dict[str, Any]:
+    """openapi_extra documenting a msgspec Struct as the route's JSON request body"""
+    (schema,), components = msgspec.json.schema_components(
+        [model], ref_template="#/components/schemas/{name}"
+    )
+    _BODY_SCHEMAS.update(components)
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+_default_openapi = app.openapi
+
+def openapi() -> Dict[str, Any]:
+    if app.openapi_schema is None:
+        schema = _default_openapi()
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(_BODY_SCHEMAS)
+    return app.openapi_schema
+
+app.openapi = openapi
+
+def upstream_status(e: Exception) -> int:
+    """
+    Status to report for a failed FHIR call: upstream 4xx answers (e.g. a deleted patient) pass
+    through, anything else (unreachable server, 5xx, malformed body) is a 502.
+    The cache decorator only falls back to stale data for 5xx statuses.
+    """
+    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+        return e.response.status_code
+    return 502
+
 # Dependency
-def get_agent():
-    # In production, you might want to get these from environment variables
-    base_fhir_url = "https://hapi.fhir.org/baseR4"
-    api_key = None
-    return HealthcareAgent(base_fhir_url, api_key)
+async def get_agent(request: Request) -> HealthcareAgent:
+    return request.app.state.agent
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Healthcare AI Agent API"}
 
 @app.get("/patient/{patient_id}")
-def get_patient(patient_id: str, agent: HealthcareAgent = Depends(get_agent)):
+@cached("normal")
+async def get_patient(patient_id: str, request: Request, agent: HealthcareAgent = Depends(get_agent)):
     try:
-        return agent.get_patient(patient_id)
+        return await agent.get_patient(patient_id)
     except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Patient not found: {str(e)}")
+        status_code = upstream_status(e)
+        reason = "Patient not found" if status_code == 404 else "Error retrieving patient"
+        raise HTTPException(status_code=status_code, detail=f"{reason}: {str(e)}")
 
-@app.post("/patients/search")
-def search_patients(search: PatientSearch, agent: HealthcareAgent = Depends(get_agent)):
-    params = {k: v for k, v in search.dict().items() if v is not None}
+@app.post("/patients/search", openapi_extra=body_schema(PatientSearch))
+async def search_patients(search: PatientSearch = Depends(body_as(PatientSearch)), agent: HealthcareAgent = Depends(get_agent)):
+    params = {k: v for k, v in msgspec.structs.asdict(search).items() if v is not None}
     try:
-        return agent.search_patients(params)
+        return await agent.search_patients(params)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching patients: {str(e)}")
 
 @app.get("/patient/{patient_id}/observations")
-def get_patient_observations(patient_id: str, agent: HealthcareAgent = Depends(get_agent)):
+@cached("short")
+async def get_patient_observations(patient_id: str, request: Request, agent: HealthcareAgent = Depends(get_agent)):
+    try:
+        return await agent.get_patient_observations(patient_id)
+    except Exception as e:
+        raise HTTPException(status_code=upstream_status(e), detail=f"Error retrieving observations: {str(e)}")
+
+@app.get("/patient/{patient_id}/full")
+async def get_patient_full(patient_id: str, agent: HealthcareAgent = Depends(get_agent)):
+    # Both upstream calls run concurrently over the shared client
+    patient = asyncio.ensure_future(agent.get_patient(patient_id))
+    observations = asyncio.ensure_future(agent.get_patient_observations(patient_id))
     try:
-        return agent.get_patient_observations(patient_id)
+        await asyncio.gather(patient, observations)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error retrieving observations: {str(e)}")
+        # gather doesn't cancel the other call when one fails; cancel it and wait for it to
+        # finish so it neither keeps running in the background nor logs an unretrieved error
+        for task in (patient, observations):
+            task.cancel()
+        await asyncio.gather(patient, observations, return_exceptions=True)
+        raise HTTPException(status_code=500, detail=f"Error retrieving patient record: {str(e)}")
+    return {"patient": patient.result(), "observations": observations.result()}
 
-@app.post("/hl7/parse")
-def parse_hl7(hl7: Hl7Message, agent: HealthcareAgent = Depends(get_agent)):
+@app.post("/hl7/parse", openapi_extra=body_schema(Hl7Message))
+async def parse_hl7(hl7: Hl7Message = Depends(body_as(Hl7Message)), agent: HealthcareAgent = Depends(get_agent)):
     try:
         return agent.parse_hl7_message(hl7.message)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error parsing HL7 message: {str(e)}")
 
-@app.post("/fhir-to-hl7")
-def convert_fhir_to_hl7(fhir: FhirData, agent: HealthcareAgent = Depends(get_agent)):
+@app.post("/fhir-to-hl7", openapi_extra=body_schema(FhirData))
+async def convert_fhir_to_hl7(fhir: FhirData = Depends(body_as(FhirData)), agent: HealthcareAgent = Depends(get_agent)):
     try:
         hl7_message = agent.convert_fhir_to_hl7(fhir.data)
         return {"hl7_message": hl7_message}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error converting FHIR to HL7: {str(e)}")
 
-@app.post("/call-api")
-def call_external_api(request: ApiRequest, agent: HealthcareAgent = Depends(get_agent)):
+@app.post("/call-api", openapi_extra=body_schema(ApiRequest))
+async def call_external_api(request: ApiRequest = Depends(body_as(ApiRequest)), agent: HealthcareAgent = Depends(get_agent)):
     try:
-        return agent.call_external_api(
+        return await agent.call_external_api(
             request.url, 
             request.method, 
             request.data, 
-            request.headers
+            request.headers,
+            request.parse
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calling external API: {str(e)}")
 
 if __name__ == "__main__":
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    from serve import main
+    main()
\ No newline at end of file
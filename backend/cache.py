@@ -0,0 +1,107 @@
+import os
+import time
+import orjson
+import functools
+from typing import Dict, Tuple
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+import redis.asyncio as redis
+
+# Cache policies: (min_ttl, max_ttl, buffer) in seconds.
+# The TTL grows with how long the upstream took, clamped to the policy's bounds.
+CACHE_POLICIES: Dict[str, Tuple[float, float, float]] = {
+    "short": (1, 10, 1),
+    "normal": (10, 30, 5),
+    "long": (30, 300, 30),
+}
+
+# How long entries are kept after going stale, so they can still serve as a fallback
+STALE_RETENTION = 24 * 60 * 60
+
+# Redis is only an optimisation: fail fast when it is slow or unreachable so requests
+# fall through to the upstream instead of waiting on the OS TCP timeout
+REDIS_CONNECT_TIMEOUT = 0.25
+REDIS_SOCKET_TIMEOUT = 0.25
+
+# Eviction is deployment config, not set from here: the Redis server backing the cache should
+# run with `maxmemory-policy allkeys-lfu` (and a maxmemory limit) so rarely used entries go first.
+
+def create_redis_client() -> redis.Redis:
+    """Build the cache's Redis client from REDIS_URL with short connect and socket timeouts"""
+    return redis.from_url(
+        os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+    )
+
+def cache_key(request: Request) -> str:
+    params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return f"cache:{request.method}:{request.url.path}?{params}"
+
+def cached(policy: str = "normal"):
+    """
+    Cache a GET endpoint's JSON response in Redis.
+    The endpoint must accept a `request: Request` parameter.
+    """
+    min_ttl, max_ttl, buffer = CACHE_POLICIES[policy]
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request: Request = kwargs["request"]
+            client: redis.Redis = request.app.state.redis
+            key = cache_key(request)
+
+            entry = {}
+            try:
+                entry = await client.hgetall(key)
+            except redis.RedisError:
+                pass
+
+            now = time.time()
+            if entry and now < float(entry[b"stale_at"]):
+                return cached_response(entry, now, "HIT")
+
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except HTTPException as e:
+                # Only an upstream failure (5xx) may serve the last known value; a real upstream
+                # answer such as 404 must reach the caller. Stale bodies are flagged in the headers.
+                if entry and e.status_code >= 500:
+                    return cached_response(entry, now, "STALE")
+                raise
+            gen_time = time.perf_counter() - started
+
+            body = orjson.dumps(result)
+            ttl = max(min_ttl, min(max_ttl, gen_time + buffer))
+            try:
+                # One transaction, so a key is never left behind without its TTL
+                async with client.pipeline(transaction=True) as pipe:
+                    pipe.hset(key, mapping={
+                        "body": body,
+                        "code": 200,
+                        "generated_at": now,
+                        "stale_at": now + ttl,
+                    })
+                    pipe.expire(key, int(ttl) + STALE_RETENTION)
+                    await pipe.execute()
+            except redis.RedisError:
+                pass
+
+            return Response(content=body, status_code=200, media_type="application/json",
+                            headers={"X-Cache": "MISS"})
+
+        return wrapper
+
+    return decorator
+
+def cached_response(entry: Dict[bytes, bytes], now: float, cache_status: str) -> Response:
+    """Replay a cached entry, with X-Cache (HIT/STALE) and its Age in seconds"""
+    age = max(0, int(now - float(entry[b"generated_at"])))
+    return Response(
+        content=entry[b"body"],
+        status_code=int(entry[b"code"]),
+        media_type="application/json",
+        headers={"X-Cache": cache_status, "Age": str(age)},
+    )
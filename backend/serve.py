@@ -0,0 +1,28 @@
+import os
+import sys
+import uvicorn
+
+HOST = "0.0.0.0"
+PORT = 8000
+
+def main():
+    """Run the API: a reloading dev server when DEV is set, otherwise Gunicorn with one Uvicorn worker per CPU"""
+    if os.getenv("DEV"):
+        uvicorn.run("api:app", host=HOST, port=PORT, reload=True)
+        return
+
+    workers = os.cpu_count() or 1
+    # gunicorn runs as a module of this interpreter so it comes from the same virtualenv.
+    # --preload imports the app (compiled regexes, templates) once before forking;
+    # each worker still opens its own HTTP and Redis clients in the lifespan
+    os.execv(sys.executable, [
+        sys.executable, "-m", "gunicorn", "api:app",
+        "-k", "uvicorn.workers.UvicornWorker",
+        "-w", str(workers),
+        "--bind", f"{HOST}:{PORT}",
+        "--chdir", os.path.dirname(os.path.abspath(__file__)),
+        "--preload",
+    ])
+
+if __name__ == "__main__":
+    main()
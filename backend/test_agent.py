@@ -0,0 +1,118 @@
+import asyncio
+import base64
+import httpx
+import orjson
+import pytest
+import agent as agent_module
+from agent import HealthcareAgent
+
+BUNDLE = {
+    "resourceType": "Bundle",
+    "total": 3,
+    "entry": [
+        {"resource": {"resourceType": "Observation", "id": str(i), "valueQuantity": {"value": 1.5 * i}}}
+        for i in range(3)
+    ]
+}
+
+def bundle_transport(chunk_size: int) -> httpx.MockTransport:
+    """Serve BUNDLE for every request, streamed in chunks of `chunk_size` bytes"""
+    body = orjson.dumps(BUNDLE)
+
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=chunks())
+
+    return httpx.MockTransport(handler)
+
+def run_with_agent(transport: httpx.MockTransport, call):
+    async def main():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await call(HealthcareAgent(client=client))
+    return asyncio.run(main())
+
+def test_bundle_entries_are_streamed_in_one_chunk():
+    entries = run_with_agent(bundle_transport(1 << 20), lambda agent: agent.get_patient_observations("1"))
+    assert entries == BUNDLE["entry"]
+
+def test_bundle_entries_are_streamed_across_chunks():
+    entries = run_with_agent(bundle_transport(7), lambda agent: agent.search_patients({"name": "Smith"}))
+    assert entries == BUNDLE["entry"]
+
+def test_bundle_without_entries_returns_empty_list():
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"resourceType": "Bundle"}))
+    assert run_with_agent(transport, lambda agent: agent.search_patients({})) == []
+
+HL7_MESSAGE = "MSH|^~\\&|APP\rPID|||12345||Smith^John||19800101|M\rOBX||NM|8302-2^Height^LN||180|cm"
+
+def test_parse_hl7_message_cache_hits_are_independent_copies():
+    agent = HealthcareAgent(client=httpx.AsyncClient())
+    first = agent.parse_hl7_message(HL7_MESSAGE)
+    first["patient_id"] = "changed"
+    first["observations"][0]["value"] = "changed"
+    first["observations"].append({})
+
+    assert agent.parse_hl7_message(HL7_MESSAGE) == {
+        "patient_id": "12345",
+        "last_name": "Smith",
+        "first_name": "John",
+        "observations": [{"id": "8302-2^Height^LN", "value": "180", "units": "cm"}]
+    }
+
+def test_parse_hl7_message_cache_skips_large_messages():
+    cached_before = len(agent_module._PARSE_CACHE)
+    large = HL7_MESSAGE + "|" + "A" * agent_module._PARSE_CACHE_MAX_MESSAGE
+    result = HealthcareAgent(client=httpx.AsyncClient()).parse_hl7_message(large)
+
+    assert result["patient_id"] == "12345"
+    assert len(agent_module._PARSE_CACHE) == cached_before
+
+def test_parse_hl7_message_cache_is_bounded_by_total_size(monkeypatch):
+    monkeypatch.setattr(agent_module, "_PARSE_CACHE_MAX_TOTAL", 4 * len(HL7_MESSAGE))
+    agent = HealthcareAgent(client=httpx.AsyncClient())
+    for i in range(20):
+        agent.parse_hl7_message(HL7_MESSAGE.replace("12345", f"{i:05d}"))
+
+    assert agent_module._parse_cache_total <= agent_module._PARSE_CACHE_MAX_TOTAL
+    assert sum(size for size, _ in agent_module._PARSE_CACHE.values()) == agent_module._parse_cache_total
+
+def test_external_calls_follow_redirects(monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "old.example":
+            return httpx.Response(301, headers={"Location": "https://new.example/x"})
+        return httpx.Response(200, json={"moved": True})
+
+    # Keep create_http_client's own settings but swap its network transport for the mock
+    monkeypatch.setattr(agent_module.httpx, "AsyncHTTPTransport", lambda **kwargs: httpx.MockTransport(handler))
+
+    async def main():
+        async with HealthcareAgent() as agent:
+            return await agent.call_external_api("http://old.example/x")
+
+    assert asyncio.run(main()) == {"moved": True}
+
+def call_with_response(response: httpx.Response, **kwargs):
+    transport = httpx.MockTransport(lambda request: response)
+    return run_with_agent(transport, lambda agent: agent.call_external_api("https://api.example/x", **kwargs))
+
+def test_unparsed_external_call_reports_error_status_without_raising():
+    result = call_with_response(httpx.Response(404, json={"error": "missing"}), parse=False)
+
+    assert result["status_code"] == 404
+    assert result["encoding"] == "text"
+    assert orjson.loads(result["content"]) == {"error": "missing"}
+
+def test_unparsed_external_call_returns_binary_body_as_base64():
+    body = bytes(range(256))
+    response = httpx.Response(200, content=body, headers={"Content-Type": "application/octet-stream"})
+    result = call_with_response(response, parse=False)
+
+    assert result["encoding"] == "base64"
+    assert base64.b64decode(result["content"]) == body
+
+def test_parsed_external_call_still_raises_on_error_status():
+    with pytest.raises(httpx.HTTPStatusError):
+        call_with_response(httpx.Response(500))
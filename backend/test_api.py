@@ -0,0 +1,158 @@
+import asyncio
+import socket
+import time
+from contextlib import contextmanager
+import httpx
+import fakeredis
+from fastapi.testclient import TestClient
+from agent import HealthcareAgent
+from api import app, get_agent
+
+PATIENT = {"resourceType": "Patient", "id": "1", "name": [{"family": "Smith", "given": ["John"]}]}
+BUNDLE = {"resourceType": "Bundle", "entry": [{"resource": {"resourceType": "Observation", "id": "o1"}}]}
+
+def client_for(handler) -> TestClient:
+    """TestClient whose agent talks to `handler` through an httpx.MockTransport"""
+    agent = HealthcareAgent(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    app.dependency_overrides[get_agent] = lambda: agent
+    return TestClient(app)
+
+def teardown_function():
+    app.dependency_overrides.clear()
+
+def test_full_patient_record_combines_both_calls():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/Observation"):
+            return httpx.Response(200, json=BUNDLE)
+        return httpx.Response(200, json=PATIENT)
+
+    with client_for(handler) as client:
+        response = client.get("/patient/1/full")
+
+    assert response.status_code == 200
+    assert response.json() == {"patient": PATIENT, "observations": BUNDLE["entry"]}
+
+def test_full_patient_record_cancels_sibling_call_on_failure():
+    cancelled = []
+
+    async def slow_patient():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    class Transport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+            if request.url.path.endswith("/Observation"):
+                return httpx.Response(503)
+            await slow_patient()
+            return httpx.Response(200, json=PATIENT)
+
+    agent = HealthcareAgent(client=httpx.AsyncClient(transport=Transport()))
+    app.dependency_overrides[get_agent] = lambda: agent
+    with TestClient(app) as client:
+        response = client.get("/patient/1/full")
+        # Checked before the client shuts down, which would cancel any leaked task anyway
+        assert cancelled == [True]
+
+    assert response.status_code == 500
+    assert "503" in response.json()["detail"]
+
+def test_post_endpoints_document_their_request_bodies():
+    schema = TestClient(app).get("/openapi.json").json()
+    for path, model in [
+        ("/patients/search", "PatientSearch"),
+        ("/hl7/parse", "Hl7Message"),
+        ("/fhir-to-hl7", "FhirData"),
+        ("/call-api", "ApiRequest"),
+    ]:
+        body = schema["paths"][path]["post"]["requestBody"]["content"]["application/json"]["schema"]
+        assert body == {"$ref": f"#/components/schemas/{model}"}
+        assert model in schema["components"]["schemas"]
+
+def test_invalid_request_body_is_rejected():
+    with client_for(lambda request: httpx.Response(200, json=PATIENT)) as client:
+        response = client.post("/hl7/parse", json={"msg": "PID|"})
+
+    assert response.status_code == 422
+
+def test_cached_endpoint_falls_through_quickly_when_redis_hangs(monkeypatch):
+    # A listening socket that is never accepted: connections succeed but nothing is ever answered
+    silent_redis = socket.socket()
+    silent_redis.bind(("127.0.0.1", 0))
+    silent_redis.listen()
+    monkeypatch.setenv("REDIS_URL", f"redis://127.0.0.1:{silent_redis.getsockname()[1]}/0")
+
+    try:
+        with client_for(lambda request: httpx.Response(200, json=PATIENT)) as client:
+            started = time.monotonic()
+            response = client.get("/patient/1")
+            elapsed = time.monotonic() - started
+    finally:
+        silent_redis.close()
+
+    assert response.status_code == 200
+    assert response.json() == PATIENT
+    assert elapsed < 2
+
+class Upstream:
+    """Mock FHIR server whose Patient response can be switched between calls"""
+
+    def __init__(self):
+        self.status_code = 200
+        self.calls = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, json={"resourceType": "OperationOutcome"})
+        return httpx.Response(200, json=PATIENT)
+
+@contextmanager
+def cached_client(upstream: Upstream, server: fakeredis.FakeServer):
+    """TestClient for `upstream` with the response cache backed by an in-memory Redis"""
+    with client_for(upstream.handler) as client:
+        app.state.redis = fakeredis.aioredis.FakeRedis(server=server)
+        yield client
+
+def mark_stale(server: fakeredis.FakeServer):
+    store = fakeredis.FakeRedis(server=server)
+    for key in store.keys("cache:*"):
+        store.hset(key, "stale_at", 0)
+
+def test_cache_serves_fresh_entries_without_calling_upstream():
+    upstream, server = Upstream(), fakeredis.FakeServer()
+    with cached_client(upstream, server) as client:
+        first = client.get("/patient/1")
+        second = client.get("/patient/1")
+
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert "Age" in second.headers
+    assert second.json() == PATIENT
+    assert upstream.calls == 1
+
+def test_cache_falls_back_to_stale_entry_when_upstream_fails():
+    upstream, server = Upstream(), fakeredis.FakeServer()
+    with cached_client(upstream, server) as client:
+        client.get("/patient/1")
+        mark_stale(server)
+        upstream.status_code = 503
+        response = client.get("/patient/1")
+
+    assert response.status_code == 200
+    assert response.json() == PATIENT
+    assert response.headers["X-Cache"] == "STALE"
+    assert "Age" in response.headers
+
+def test_cache_does_not_mask_upstream_not_found():
+    upstream, server = Upstream(), fakeredis.FakeServer()
+    with cached_client(upstream, server) as client:
+        client.get("/patient/1")
+        mark_stale(server)
+        upstream.status_code = 404
+        response = client.get("/patient/1")
+
+    assert response.status_code == 404
+    assert "X-Cache" not in response.headers